@@ -2,22 +2,60 @@ import logging
 import os
 import sys
 import pathlib
+import queue
 import re
-import shutil
 import subprocess
-import time
+import threading
+from functools import cached_property
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
 
 from libzim.reader import Archive
 from libzim.writer import Creator, Item, StringProvider, FileProvider, Hint
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QWidget, QPushButton, QLineEdit, QFormLayout,
-    QFileDialog, QMessageBox, QComboBox, QGridLayout, QTextEdit, QListWidget
+    QFileDialog, QMessageBox, QComboBox, QGridLayout, QTextEdit, QListWidget, QProgressBar
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QObject, QRunnable, QThreadPool, Signal
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.basicConfig(level=logging.WARNING)
 
+_TAG_RE = re.compile(rb"<[^<]+?>")
+_SANITIZE_TABLE = str.maketrans({c: '_' for c in '<>:"/\\|?*'})
+
+_EXT_TO_MIME = {
+    ".html": "text/html",
+    ".htm": "text/html",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".css": "text/css",
+    ".js": "application/javascript",
+    ".pdf": "application/pdf",
+    ".zip": "application/zip",
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    ".ogg": "video/ogg",
+}
+
+_EXT_TO_NAMESPACE = {
+    ".html": "A",
+    ".htm": "A",
+    ".png": "I",
+    ".jpg": "I",
+    ".jpeg": "I",
+    ".css": "S",
+    ".js": "S",
+    ".pdf": "F",
+    ".mp4": "V",
+    ".webm": "V",
+    ".ogg": "V",
+}
+
 class ZimManager:
     namespace_descriptions = {
         "A": "Article",
@@ -38,12 +76,16 @@ class ZimManager:
     def get_namespace_description(self, namespace):
         return self.namespace_descriptions.get(namespace, f"Unknown ({namespace})")
 
-    def get_namespaces(self):
+    @cached_property
+    def namespaces(self):
         namespaces = self.view_all_namespaces()
         return {**self.namespace_descriptions, **namespaces, "ALL": "Select all namespaces", "UNKNOWN": "Select all unknown namespaces"}
 
+    def get_namespaces(self):
+        return self.namespaces
+
     def set_namespace(self, selected_ns):
-        namespaces = self.get_namespaces()
+        namespaces = self.namespaces
         selected_ns_upper = selected_ns.upper().strip()
 
         if selected_ns_upper == "ALL":
@@ -57,67 +99,95 @@ class ZimManager:
 
         return self.selected_namespace
 
+    @cached_property
+    def path_index(self):
+        return [entry.path for entry in self._iter_entries()]
+
     def view_all_namespaces(self):
         namespaces = {}
-        for i in range(self.zim.entry_count):
-            entry = self.get_entry(i)
-            namespace_char = entry.path[0] if entry.path else None
+        for path in self.path_index:
+            namespace_char = path[0] if path else None
             if namespace_char not in self.namespace_descriptions and namespace_char:
                 namespaces[namespace_char] = f"Unknown_{namespace_char}"
         return namespaces
 
-    def get_entry(self, entry_id):
-        return self.zim._get_entry_by_id(entry_id)
+    def _iter_entries(self):
+        for attr in ("iter_efficient", "iter_by_path"):
+            iterator = getattr(self.zim, attr, None)
+            if iterator is not None:
+                yield from iterator()
+                return
+        for i in range(self.zim.entry_count):
+            yield self.zim._get_entry_by_id(i)
+
+    def _extract_body(self, raw):
+        start = raw.find(b"<body")
+        if start < 0:
+            return None
+        start = raw.find(b">", start)
+        if start < 0:
+            return None
+        end = raw.find(b"</body>", start + 1)
+        return raw[start + 1:end if end > 0 else None]
+
+    def _strip_html(self, raw):
+        if HTMLParser is not None:
+            try:
+                body = HTMLParser(raw).body
+                if body is not None:
+                    return body.text(separator="\n").encode('utf-8')
+            except Exception:
+                pass
+        body = self._extract_body(raw)
+        if body is not None:
+            return _TAG_RE.sub(b'', body).decode('utf-8', errors='ignore').encode('utf-8')
+        return None
 
     def extract_all_text(self, output_file, namespace):
-        with open(output_file, 'w', encoding='utf-8') as outfile:
-            for i in range(self.zim.entry_count):
-                entry = self.get_entry(i)
+        with open(output_file, 'wb', buffering=1 << 20) as outfile:
+            for entry in self._iter_entries():
                 if entry.path.startswith(namespace):
-                    article = entry.get_item().content.tobytes().decode('utf-8', errors='ignore')
-                    body = re.search(r"<body.*?>(.*?)</body>", article, re.S)
-                    if body:
-                        clean_text = re.sub('<[^<]+?>', '', body.group(1))
-                        outfile.write(clean_text + "\n\n")
+                    raw = entry.get_item().content.tobytes()
+                    clean_text = self._strip_html(raw)
+                    if clean_text is not None:
+                        outfile.write(clean_text)
+                        outfile.write(b"\n\n")
 
     def extract_titles(self, namespace):
         results = []
-        for i in range(self.zim.entry_count):
-            entry = self.get_entry(i)
+        for entry in self._iter_entries():
             if entry.path.startswith(namespace):
                 results.append((entry.path, entry.title))
         return results
 
+    def iter_all_paths(self, namespace=None):
+        for path in self.path_index:
+            if namespace is None or path.startswith(namespace):
+                yield path
+
     def list_all_paths(self, namespace=None):
-        paths = []
-        for i in range(self.zim.entry_count):
-            entry = self.get_entry(i)
-            if namespace is None or entry.path.startswith(namespace):
-                paths.append(entry.path)
-        return paths
+        return list(self.iter_all_paths(namespace))
 
     def save_titles_to_file(self, output_file_path, namespace):
         results = self.extract_titles(namespace)
         if not results:
             raise ValueError("No titles found.")
 
-        with open(output_file_path, 'w', encoding='utf-8') as outfile:
+        with open(output_file_path, 'wb', buffering=1 << 20) as outfile:
             for url, title in results:
-                outfile.write(f"Title: {title}\nURL: {url}\n\n")
+                outfile.write(f"Title: {title}\nURL: {url}\n\n".encode('utf-8'))
 
     def save_selected_articles(self, output_file, selected_urls):
-        with open(output_file, 'w', encoding='utf-8') as outfile:
+        with open(output_file, 'wb', buffering=1 << 20) as outfile:
             for selected_url in selected_urls:
                 entry = self.zim.get_entry_by_path(selected_url)
                 if entry:
-                    article = entry.get_item().content.tobytes().decode('utf-8', errors='ignore')
-                    body = re.search(r"<body.*?>(.*?)</body>", article, re.S)
-                    if body:
-                        clean_text = re.sub('<[^<]+?>', '', body.group(1))
-                        outfile.write(f"Title: {entry.title}\n\n{clean_text}\n\n")
-                    else:
-                        clean_text = re.sub('<[^<]+?>', '', article)
-                        outfile.write(f"Title: {entry.title}\n\n{clean_text}\n\n")
+                    raw = entry.get_item().content.tobytes()
+                    clean_text = self._strip_html(raw)
+                    if clean_text is None:
+                        clean_text = _TAG_RE.sub(b'', raw).decode('utf-8', errors='ignore').encode('utf-8')
+                    outfile.writelines((f"Title: {entry.title}\n\n".encode('utf-8'),
+                                        clean_text, b"\n\n"))
 
     def view_file(self, file_path):
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
@@ -127,11 +197,11 @@ class ZimManager:
         if url:
             try:
                 if sys.platform == 'win32':
-                    subprocess.run(['start', url], check=True, shell=True)
+                    os.startfile(url)
                 elif sys.platform == 'darwin':
-                    subprocess.run(['open', url], check=True)
+                    subprocess.Popen(['open', url], close_fds=True)
                 else:
-                    subprocess.run(['xdg-open', url], check=True)
+                    subprocess.Popen(['xdg-open', url], close_fds=True)
                 return f"Opening: {url}"
             except Exception as e:
                 raise RuntimeError(f"Failed to open URL: {e}")
@@ -151,67 +221,88 @@ class ZimManager:
         self.extract_by_mimetype(output_dir, namespace, "application/javascript")
 
     def _sanitize_filename(self, filename):
-        return re.sub(r'[<>:"/\\|?*]', '_', filename)
+        return filename.translate(_SANITIZE_TABLE)
 
     def extract_by_mimetype(self, output_dir, namespace, mimetype):
-        pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+        out_root = pathlib.Path(output_dir)
+        out_root.mkdir(parents=True, exist_ok=True)
+        seen_dirs = {out_root}
+        binary = any(media in mimetype for media in ['image', 'video', 'application/octet-stream'])
+
+        if namespace is None:
+            match = lambda path: True
+        elif namespace == "UNKNOWN":
+            unknown_chars = {path[0] for path in self.path_index
+                             if path and path[0] not in self.namespace_descriptions}
+            match = lambda path: path[0] in unknown_chars
+        else:
+            match = lambda path: path[0] == namespace
 
-        for i in range(self.zim.entry_count):
-            entry = self.get_entry(i)
-            if not entry.path:
-                print(f"Warning: Entry {i} has an empty path, skipping.")
-                continue
-
-            item = entry.get_item()
-            item_mimetype = self._determine_mimetype(entry.path)
-            entry_namespace = entry.path[0]
-
-            if ((namespace is None or entry_namespace == namespace) or
-                (namespace == "UNKNOWN" and self.get_namespace_description(entry_namespace).startswith("Unknown"))) \
-                    and item_mimetype.startswith(mimetype):
-
-                content = item.content.tobytes()
-                file_extension = item_mimetype.split('/')[-1]
-                sanitized_path = self._sanitize_filename(entry.path)
-                file_path = pathlib.Path(output_dir) / f"{sanitized_path}.{file_extension}"
-                file_path.parent.mkdir(parents=True, exist_ok=True)
-
-                if any(media in mimetype for media in ['image', 'video', 'application/octet-stream']):
-                    with open(file_path, 'wb') as file:
-                        file.write(content)
-                else:
-                    with open(file_path, 'w', encoding='utf-8', errors='ignore') as file:
-                        file.write(content.decode('utf-8', errors='ignore'))
+        tasks = queue.Queue(maxsize=64)
+        write_errors = []
+
+        def write_files():
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                try:
+                    self._write_one(task)
+                except Exception as e:
+                    write_errors.append(e)
+
+        writers = [threading.Thread(target=write_files) for _ in range(4)]
+        for writer in writers:
+            writer.start()
+
+        extracted = 0
+        try:
+            for entry in self._iter_entries():
+                if not entry.path:
+                    logging.info("Entry with empty path, skipping.")
+                    continue
+
+                item_mimetype = self._determine_mimetype(entry.path)
+
+                if match(entry.path) and item_mimetype.startswith(mimetype):
+                    file_extension = item_mimetype.split('/')[-1]
+                    sanitized_path = self._sanitize_filename(entry.path)
+                    file_path = out_root / f"{sanitized_path}.{file_extension}"
+                    parent = file_path.parent
+                    if parent not in seen_dirs:
+                        parent.mkdir(parents=True, exist_ok=True)
+                        seen_dirs.add(parent)
+                    tasks.put((file_path, entry.get_item().content.tobytes(), binary))
+                    extracted += 1
+        finally:
+            for _ in writers:
+                tasks.put(None)
+            for writer in writers:
+                writer.join()
+
+        if write_errors:
+            raise write_errors[0]
+
+        print(f"{extracted} files of type {mimetype} extracted to {output_dir}")
 
-                print(f"Extracted: {file_path}")
+    def _write_one(self, task):
+        file_path, content, binary = task
 
-        print(f"All files of type {mimetype} extracted to {output_dir}")
+        if not binary:
+            content = content.decode('utf-8', errors='ignore').encode('utf-8')
+
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(content)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
 
     def _determine_mimetype(self, path):
         if path.startswith("A/"):
             return "text/html"
-        elif path.endswith(".html") or path.endswith(".htm"):
-            return "text/html"
-        elif path.endswith(".png"):
-            return "image/png"
-        elif path.endswith(".jpg") or path.endswith(".jpeg"):
-            return "image/jpeg"
-        elif path.endswith(".css"):
-            return "text/css"
-        elif path.endswith(".js"):
-            return "application/javascript"
-        elif path.endswith(".pdf"):
-            return "application/pdf"
-        elif path.endswith(".zip"):
-            return "application/zip"
-        elif path.endswith(".mp4"):
-            return "video/mp4"
-        elif path.endswith(".webm"):
-            return "video/webm"
-        elif path.endswith(".ogg"):
-            return "video/ogg"
-        else:
-            return "application/octet-stream"
+        return _EXT_TO_MIME.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
 
     class MyItem(Item):
         def __init__(self, title, path, content="", fpath=None):
@@ -228,18 +319,7 @@ class ZimManager:
             return self._title
 
         def get_mimetype(self):
-            if self._path.endswith(".html") or self._path.endswith(".htm"):
-                return "text/html"
-            elif self._path.endswith(".png"):
-                return "image/png"
-            elif self._path.endswith(".jpg") or self._path.endswith(".jpeg"):
-                return "image/jpeg"
-            elif self._path.endswith(".css"):
-                return "text/css"
-            elif self._path.endswith(".js"):
-                return "application/javascript"
-            else:
-                return "application/octet-stream"
+            return _EXT_TO_MIME.get(os.path.splitext(self._path)[1].lower(), "application/octet-stream")
 
         def get_contentprovider(self):
             if self._fpath:
@@ -251,13 +331,13 @@ class ZimManager:
 
     def create_zim_file(self, output_file, articles, main_article_path):
         temp_output_file = f"{output_file}.tmp"
-        backup_file = f"{output_file}.backup"
         try:
             with Creator(temp_output_file).config_indexing(True, "eng") as creator:
                 creator.set_mainpath(main_article_path)
                 for article in articles:
-                    print(f"Processing article: {article['title']} with path: {article['path']}")
-                    item = self.MyItem(article['title'], article['path'], article['content'])
+                    logging.info("Processing article: %s with path: %s", article['title'], article['path'])
+                    item = self.MyItem(article['title'], article['path'],
+                                       article.get('content', ''), article.get('fpath'))
                     creator.add_item(item)
 
                 for name, value in {
@@ -271,20 +351,9 @@ class ZimManager:
                 }.items():
                     creator.add_metadata(name.title(), value)
 
-            if os.path.exists(output_file):
-                try:
-                    os.rename(output_file, backup_file)
-                except PermissionError:
-                    print("Permission denied while renaming the existing file, retrying...")
-                    time.sleep(2)
-                    os.rename(output_file, backup_file)
-
-            shutil.move(temp_output_file, output_file)
+            os.replace(temp_output_file, output_file)
             print(f"ZIM file created successfully at {output_file}")
 
-            if os.path.exists(backup_file):
-                os.remove(backup_file)
-
         finally:
             if os.path.exists(temp_output_file):
                 os.remove(temp_output_file)
@@ -297,35 +366,42 @@ class ZimManager:
                 file_path = os.path.join(root, file)
                 relative_path = os.path.relpath(file_path, input_directory)
 
-                if file.endswith(".html") or file.endswith(".htm"):
-                    namespace = "A"
-                elif file.endswith(".png") or file.endswith(".jpg") or file.endswith(".jpeg"):
-                    namespace = "I"
-                elif file.endswith(".css"):
-                    namespace = "S"
-                elif file.endswith(".js"):
-                    namespace = "S"
-                elif file.endswith(".pdf"):
-                    namespace = "F"
-                elif file.endswith(".mp4") or file.endswith(".webm") or file.endswith(".ogg"):
-                    namespace = "V"
-                else:
-                    namespace = "F"
+                namespace = _EXT_TO_NAMESPACE.get(os.path.splitext(file)[1].lower(), "F")
 
                 zim_path = f"{namespace}/{relative_path.replace(os.path.sep, '/')}"
 
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-
                 articles.append({
                     "title": os.path.splitext(file)[0],
                     "path": zim_path,
-                    "content": content
+                    "fpath": file_path
                 })
 
         self.create_zim_file(output_file, articles, main_article_path)
 
 
+class WorkerSignals(QObject):
+    result = Signal(object, object)
+    error = Signal(str, str)
+
+
+class Worker(QRunnable):
+    def __init__(self, title, fn, args, on_result):
+        super().__init__()
+        self.title = title
+        self.fn = fn
+        self.args = args
+        self.on_result = on_result
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args)
+        except Exception as e:
+            self.signals.error.emit(self.title, str(e))
+        else:
+            self.signals.result.emit(self.on_result, result)
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -350,8 +426,28 @@ class MainWindow(QMainWindow):
         self.add_zim_creation_functionality(zimmanager_bottom_right_layout)
         grid_layout.addWidget(zimmanager_bottom_right_widget, 1, 1)
 
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.hide()
+        grid_layout.addWidget(self.progress_bar, 2, 0, 1, 2)
+
         self.showMaximized()
 
+    def _start_worker(self, title, fn, args, on_result):
+        worker = Worker(title, fn, args, on_result)
+        worker.signals.result.connect(self._worker_finished)
+        worker.signals.error.connect(self._worker_failed)
+        self.progress_bar.show()
+        QThreadPool.globalInstance().start(worker)
+
+    def _worker_finished(self, on_result, result):
+        self.progress_bar.hide()
+        on_result(result)
+
+    def _worker_failed(self, title, message):
+        self.progress_bar.hide()
+        QMessageBox.critical(self, title, message)
+
     def add_zimmanager_functions(self, layout):
         zimmanager_form_layout = QFormLayout()
 
@@ -446,8 +542,10 @@ class MainWindow(QMainWindow):
             return
 
         manager = ZimManager(zim_file)
-        manager.extract_by_mimetype(output_dir, None, mimetype)
-        QMessageBox.information(self, "Extract by MIME Type", f"Files of MIME type {mimetype} extracted to {output_dir}")
+        self._start_worker(
+            "Extract by MIME Type", manager.extract_by_mimetype, (output_dir, None, mimetype),
+            lambda _: QMessageBox.information(
+                self, "Extract by MIME Type", f"Files of MIME type {mimetype} extracted to {output_dir}"))
 
     def run_extract_titles(self):
         zim_file = self.zim_file_input.text()
@@ -459,8 +557,10 @@ class MainWindow(QMainWindow):
         manager = ZimManager(zim_file)
         selected_namespace = None
 
-        manager.save_titles_to_file(output_file, selected_namespace)
-        QMessageBox.information(self, "Extract Titles", f"Titles extracted to {output_file}")
+        self._start_worker(
+            "Extract Titles", manager.save_titles_to_file, (output_file, selected_namespace),
+            lambda _: QMessageBox.information(
+                self, "Extract Titles", f"Titles extracted to {output_file}"))
 
     def run_list_paths(self):
         zim_file = self.zim_file_input.text()
@@ -470,9 +570,16 @@ class MainWindow(QMainWindow):
 
         manager = ZimManager(zim_file)
         namespace = None
-        paths = manager.list_all_paths(namespace)
+        self._start_worker(
+            "List All Paths", manager.list_all_paths, (namespace,), self._show_paths)
+
+    def _show_paths(self, paths):
         self.list_paths_widget.clear()
-        self.list_paths_widget.addItems(paths)
+        self.list_paths_widget.setUniformItemSizes(True)
+        batch_size = 5000
+        for start in range(0, len(paths), batch_size):
+            self.list_paths_widget.addItems(paths[start:start + batch_size])
+            QApplication.processEvents()
 
     def run_save_selected_articles(self):
         zim_file = self.zim_file_input.text()
@@ -484,8 +591,10 @@ class MainWindow(QMainWindow):
             return
 
         manager = ZimManager(zim_file)
-        manager.save_selected_articles(output_file, selected_urls)
-        QMessageBox.information(self, "Save Selected Articles", f"Articles saved to {output_file}")
+        self._start_worker(
+            "Save Selected Articles", manager.save_selected_articles, (output_file, selected_urls),
+            lambda _: QMessageBox.information(
+                self, "Save Selected Articles", f"Articles saved to {output_file}"))
 
     def run_create_zim_file(self):
         zim_output_file = self.zim_output_file_input.text()
@@ -497,8 +606,11 @@ class MainWindow(QMainWindow):
             return
 
         manager = ZimManager()
-        manager.create_zim_file_from_directory_auto(zim_output_file, main_article_path, input_directory)
-        QMessageBox.information(self, "ZIM File Creation", f"ZIM file created successfully at {zim_output_file}")
+        self._start_worker(
+            "ZIM File Creation", manager.create_zim_file_from_directory_auto,
+            (zim_output_file, main_article_path, input_directory),
+            lambda _: QMessageBox.information(
+                self, "ZIM File Creation", f"ZIM file created successfully at {zim_output_file}"))
 
     def select_file(self, line_edit):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select File", "", "All Files (*)")